@@ -1,24 +1,57 @@
 # database.py
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import declarative_base, sessionmaker
 
-# Используем PostgreSQL на Render, SQLite локально
+# Используем PostgreSQL на Render, SQLite локально.
+# Без DATABASE_URL на Render файл SQLite кладём на постоянный диск /data.
 DATABASE_URL = os.getenv(
     'DATABASE_URL',
-    'sqlite:///./forecast_mvp.db'  # Fallback для локальной разработки
+    'sqlite:////data/forecast_mvp.db' if os.getenv('RENDER')
+    else 'sqlite:///./forecast_mvp.db'  # Fallback для локальной разработки
 )
 
-# Если URL начинается с postgres://, меняем на postgresql://
-if DATABASE_URL.startswith('postgres://'):
-    DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+# Если URL начинается с postgres:// или postgresql:// без драйвера,
+# подключаемся через psycopg 3 (postgresql+psycopg://)
+for prefix in ('postgres://', 'postgresql://'):
+    if DATABASE_URL.startswith(prefix):
+        DATABASE_URL = DATABASE_URL.replace(prefix, 'postgresql+psycopg://', 1)
+        break
 
-engine = create_engine(DATABASE_URL)
+if DATABASE_URL.startswith('sqlite'):
+    # SQLite: пул по умолчанию (QueuePool для файла), доступ из потоков FastAPI
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False}
+    )
+else:
+    # PostgreSQL: переиспользуем соединения и отбрасываем «мёртвые» до запроса.
+    # pool_size + max_overflow = 40 — по размеру пула потоков FastAPI (40 на воркер),
+    # чтобы sync-эндпоинты не ждали свободное соединение. При нескольких воркерах
+    # итог умножается на WEB_CONCURRENCY — держите его ниже лимита соединений БД.
+    # LIFO оставляет «тёплым» небольшое подмножество соединений.
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.getenv('DB_POOL_SIZE', 20)),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_use_lifo=True
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def dialect_insert(db, model):
+    """INSERT с поддержкой on_conflict_do_update/do_nothing для текущей БД (PostgreSQL / SQLite)"""
+    if db.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -2,6 +2,7 @@
 import os
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from typing import List
+from jinja2 import Template
 
 # Конфигурация для Mail.ru SMTP
 conf = ConnectionConfig(
@@ -16,10 +17,12 @@ conf = ConnectionConfig(
     VALIDATE_CERTS=True
 )
 
-async def send_welcome_email(email: str, username: str, store_name: str):
-    """Отправляет приветственное письмо новому пользователю"""
-    
-    html_content = f"""
+# Один клиент на процесс вместо FastMail(conf) на каждое письмо
+_fast_mail = FastMail(conf)
+
+# Шаблоны письма компилируются один раз при импорте модуля.
+# autoescape экранирует username/store_name в HTML-версии.
+_WELCOME_HTML_TMPL = Template("""
     <html>
         <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
             <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; border-radius: 10px 10px 0 0;">
@@ -27,11 +30,11 @@ async def send_welcome_email(email: str, username: str, store_name: str):
             </div>
             
             <div style="background: #f9fafb; padding: 30px; border-radius: 0 0 10px 10px;">
-                <h2 style="color: #1f2937;">Привет, {username}!</h2>
+                <h2 style="color: #1f2937;">Привет, {{ username }}!</h2>
                 
                 <p style="color: #4b5563; font-size: 16px; line-height: 1.6;">
                     Спасибо за регистрацию в системе прогнозирования спроса! 
-                    Ваша компания<strong style="color: #667eea;">"{store_name}"</strong> успешно добавлена.
+                    Ваша компания<strong style="color: #667eea;">"{{ store_name }}"</strong> успешно добавлена.
                 </p>
                 
                 <div style="background: white; border-left: 4px solid #667eea; padding: 15px; margin: 20px 0;">
@@ -65,13 +68,13 @@ async def send_welcome_email(email: str, username: str, store_name: str):
             </div>
         </body>
     </html>
-    """
-    
-    text_content = f"""
-    Добро пожаловать, {username}!
+    """, autoescape=True)
+
+_WELCOME_TEXT_TMPL = Template("""
+    Добро пожаловать, {{ username }}!
     
     Спасибо за регистрацию в системе прогнозирования спроса.
-    Ваш магазин "{store_name}" успешно добавлен.
+    Ваш магазин "{{ store_name }}" успешно добавлен.
     
     Что дальше?
     - Загрузите данные о продажах
@@ -80,7 +83,14 @@ async def send_welcome_email(email: str, username: str, store_name: str):
     
     С уважением,
     Команда Forecast System
-    """
+    """)
+
+
+async def send_welcome_email(email: str, username: str, store_name: str):
+    """Отправляет приветственное письмо новому пользователю"""
+    
+    html_content = _WELCOME_HTML_TMPL.render(username=username, store_name=store_name)
+    text_content = _WELCOME_TEXT_TMPL.render(username=username, store_name=store_name)
     
     message = MessageSchema(
         subject="🎉 Добро пожаловать в систему прогнозирования!",
@@ -90,5 +100,4 @@ async def send_welcome_email(email: str, username: str, store_name: str):
         subtype=MessageType.html
     )
     
-    fm = FastMail(conf)
-    await fm.send_message(message)
+    await _fast_mail.send_message(message)
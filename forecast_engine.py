@@ -1,20 +1,122 @@
 # forecast_engine.py (ИСПРАВЛЕННАЯ ВЕРСИЯ)
 
+import os
+
+# Один поток BLAS/OpenMP на процесс: модели обучаются параллельно процессами loky,
+# а вложенные потоки numpy/Stan на каждом ядре только мешают друг другу.
+# Задаётся до импорта numpy; процессы-воркеры наследуют эти переменные.
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import re
+import copy
+import hashlib
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from typing import Dict
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy import func, distinct, delete, select
 from sqlalchemy.orm import Session
+from fastapi import BackgroundTasks
+from joblib import Parallel, delayed
 from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
+
+from database import SessionLocal, dialect_insert
+from models import Product, SalesHistory, Forecast, DashboardCache
+
+# Кэш обученных моделей Prophet: на Render — постоянный диск /data, локально — рядом с БД
+PROPHET_CACHE_DIR = os.getenv(
+    'PROPHET_CACHE_DIR',
+    '/data/prophet_cache' if os.getenv('RENDER') else './prophet_cache'
+)
+
+# Версия настроек обучения Prophet: увеличьте при их изменении, чтобы
+# модели в кэше переобучились
+PROPHET_MODEL_VERSION = 1
+
+# Годовую сезонность Prophet включаем только при истории от двух лет
+YEARLY_SEASONALITY_MIN_DAYS = 730
+
+# Ряды короче этого прогнозируем без Prophet (сезонный наивный метод)
+MIN_PROPHET_HISTORY_DAYS = 180
+
+# До этой длины ряда оптимизируем Prophet методом Ньютона, дальше — LBFGS
+NEWTON_MAX_HISTORY_DAYS = 500
 
-from models import Product, SalesHistory, Forecast
-from utils import parse_date
+# Строк продаж в одном пакете UPSERT при загрузке CSV
+INGEST_BATCH_ROWS = 50_000
+
+# Форматы дат с днём впереди, которые чаще всего встречаются в выгрузках
+_DAYFIRST_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y")
+# Те же форматы (и ISO) для распознавания дат прямо при чтении CSV через Arrow
+_ARROW_TIMESTAMP_PARSERS = [pa_csv.ISO8601, *_DAYFIRST_FORMATS]
+
+# Определение колонок CSV одним регулярным выражением. Альтернативы проверяются
+# по порядку (как цепочка if/elif): первая сработавшая группа задаёт тип колонки.
+_COLUMN_RX = re.compile(
+    r'(?P<date>.*?(?:дата|date))'
+    r'|(?P<sku>.*?(?:артикул|sku|код))'
+    r'|(?P<name>.*?(?:товар|product|название))'
+    r'|(?P<quantity>.*?(?:кол|qty|количество))'
+    r'|(?P<price>.*?(?:цена|price|стоимость))',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+# Кэш сезонных признаков (матрицы Фурье) в пределах процесса-воркера.
+# У товаров с одинаковым календарём продаж признаки совпадают.
+_SEASONAL_FEATURES_CACHE: Dict[tuple, tuple] = {}
+_SEASONAL_FEATURES_CACHE_SIZE = 64
+
+
+class _SharedFeaturesProphet(Prophet):
+    """Prophet, переиспользующий сезонные признаки для одинаковых дат между моделями"""
+
+    def make_all_seasonality_features(self, df):
+        # Праздники, регрессоры и условные сезонности зависят не только от дат —
+        # такие модели не кэшируем
+        if (
+            self.holidays is not None
+            or self.country_holidays
+            or self.extra_regressors
+            or any(props['condition_name'] is not None for props in self.seasonalities.values())
+        ):
+            return super().make_all_seasonality_features(df)
+
+        # Признаки считаются по каждой дате: ключ — хэш всей колонки ds
+        # (у двух рядов с одинаковыми границами могут отсутствовать разные дни)
+        key = (
+            hashlib.blake2b(df['ds'].values.astype('datetime64[ns]').tobytes()).hexdigest(),
+            tuple(
+                (name, tuple(sorted(props.items())))
+                for name, props in self.seasonalities.items()
+            )
+        )
+        cached = _SEASONAL_FEATURES_CACHE.get(key)
+        if cached is None:
+            cached = super().make_all_seasonality_features(df)
+            if len(_SEASONAL_FEATURES_CACHE) >= _SEASONAL_FEATURES_CACHE_SIZE:
+                _SEASONAL_FEATURES_CACHE.pop(next(iter(_SEASONAL_FEATURES_CACHE)))
+            _SEASONAL_FEATURES_CACHE[key] = cached
+
+        seasonal_features, prior_scales, component_cols, modes = cached
+        return (
+            seasonal_features.copy(),
+            list(prior_scales),
+            component_cols.copy(),
+            copy.deepcopy(modes)
+        )
 
 
 def process_sales_and_forecast(
     db: Session,
     user_id: int,
     file_path: str,
-    separator: str = ","
+    separator: str = ",",
+    background_tasks: Optional[BackgroundTasks] = None
 ) -> Dict[str, int]:
     """
     Основная логика MVP:
@@ -22,27 +124,58 @@ def process_sales_and_forecast(
     2. Создание/обновление товаров
     3. Сохранение истории продаж
     4. Прогнозирование через Prophet
+
+    Если передан background_tasks, прогнозирование выполняется после отправки
+    ответа (в своей сессии БД), иначе — синхронно в текущем запросе.
+    """
+    stats, product_ids = ingest_csv(db, user_id, file_path, separator)
+
+    if background_tasks is not None:
+        background_tasks.add_task(refresh_forecasts, user_id, product_ids)
+    else:
+        _generate_forecasts(db, product_ids)
+
+    return stats
+
+
+def _read_sales_csv(file_path: str, separator: str = ",") -> pd.DataFrame:
+    """
+    Чтение CSV: многопоточный парсер Arrow (даты ISO и с днём впереди распознаются
+    сразу при чтении), при неудаче — прежний путь с обработкой кодировок.
     """
-    # Чтение CSV с обработкой кодировок
     try:
-        df = pd.read_csv(file_path, sep=separator, encoding='utf-8')
-    except UnicodeDecodeError:
-        df = pd.read_csv(file_path, sep=separator, encoding='cp1251')
+        # ISO-даты Arrow читает как date32: date_as_object=False отдаёт их
+        # колонкой datetime64, а не объектами date — _parse_dates их не трогает
+        return pa_csv.read_csv(
+            file_path,
+            parse_options=pa_csv.ParseOptions(delimiter=separator),
+            convert_options=pa_csv.ConvertOptions(timestamp_parsers=_ARROW_TIMESTAMP_PARSERS)
+        ).to_pandas(date_as_object=False)
+    except (UnicodeDecodeError, pa.ArrowInvalid, pd.errors.ParserError):
+        try:
+            return pd.read_csv(file_path, sep=separator, encoding='utf-8')
+        except UnicodeDecodeError:
+            return pd.read_csv(file_path, sep=separator, encoding='cp1251')
+
+
+def ingest_csv(
+    db: Session,
+    user_id: int,
+    file_path: str,
+    separator: str = ","
+) -> Tuple[Dict[str, int], List[int]]:
+    """
+    Загрузка CSV без прогнозирования: парсинг, товары, история продаж.
+    Возвращает статистику загрузки и id затронутых товаров.
+    """
+    df = _read_sales_csv(file_path, separator)
 
     # Автоопределение колонок (гибкость!)
     column_mapping = {}
     for col in df.columns:
-        col_lower = col.lower().strip()
-        if 'дата' in col_lower or 'date' in col_lower:
-            column_mapping['date'] = col
-        elif 'артикул' in col_lower or 'sku' in col_lower or 'код' in col_lower:
-            column_mapping['sku'] = col
-        elif 'товар' in col_lower or 'product' in col_lower or 'название' in col_lower:
-            column_mapping['name'] = col
-        elif 'кол' in col_lower or 'qty' in col_lower or 'количество' in col_lower:
-            column_mapping['quantity'] = col
-        elif 'цена' in col_lower or 'price' in col_lower or 'стоимость' in col_lower:
-            column_mapping['price'] = col
+        m = _COLUMN_RX.match(col)
+        if m:
+            column_mapping[m.lastgroup] = col
 
     if len(column_mapping) < 5:
         raise ValueError(f"Не удалось определить все колонки. Найдено: {list(column_mapping.keys())}")
@@ -56,112 +189,372 @@ def process_sales_and_forecast(
         column_mapping['price']: 'цена'
     })
 
-    # Преобразование дат
-    df['дата'] = df['дата'].apply(parse_date)
+    # Преобразование дат (векторно, по всей колонке сразу)
+    df['дата'] = _parse_dates(df['дата'])
     df = df.dropna(subset=['дата'])  # Удаляем строки с невалидными датами
+    df['дата'] = df['дата'].dt.date
+    # Одна запись на товар в день: при повторе в файле берём последнюю строку
+    df = df.drop_duplicates(subset=['артикул', 'дата'], keep='last')
 
-    rows_loaded = 0
-    products_seen = set()
+    # Один проход groupby вместо маски df[df['артикул'] == sku] на каждый SKU
+    grouped = df.groupby('артикул', sort=False)
+    new_days_per_sku = grouped['дата'].nunique()
+    last_rows = df.sort_values('дата', kind='stable')\
+        .groupby('артикул', sort=False).tail(1)\
+        .set_index('артикул')
+    skus_in_file = new_days_per_sku.index.tolist()
 
-    # Проверяем наличие минимум 30 дней для каждого SKU
-    skus_in_file = df['артикул'].unique()
+    # Один запрос вместо поиска товара на каждую строку CSV
+    sku_to_pid = {
+        sku: pid
+        for sku, pid in db.query(Product.sku, Product.id)
+        .filter(Product.user_id == user_id, Product.sku.in_(skus_in_file))
+    }
+
+    known_pids = list(sku_to_pid.values())
+
+    # Проверяем наличие минимум 30 дней для каждого SKU (один GROUP BY на все товары).
+    # У новых товаров истории ещё нет — в запрос их не включаем.
+    existing_days_by_pid = dict(
+        db.query(SalesHistory.product_id, func.count(distinct(SalesHistory.date)))
+        .filter(SalesHistory.product_id.in_(known_pids))
+        .group_by(SalesHistory.product_id)
+        .all()
+    ) if known_pids else {}
+
+    existing_days_per_sku = pd.Series(
+        {sku: existing_days_by_pid.get(pid, 0) for sku, pid in sku_to_pid.items()},
+        dtype='int64'
+    )
+    total_days = new_days_per_sku.add(existing_days_per_sku, fill_value=0).astype(int)
+    bad = total_days[total_days < 30]
+
+    # Сообщаем обо всех проблемных SKU сразу, до создания товаров и записи в БД
+    if not bad.empty:
+        details = ", ".join(f"'{sku}' — {days} дн." for sku, days in bad.items())
+        raise ValueError(
+            f"Недостаточно данных (нужно ≥30 дней): {details}"
+        )
 
+    new_products = []
     for sku in skus_in_file:
-        product = db.query(Product).filter_by(user_id=user_id, sku=sku).first()
-        
-        if not product:
-            # Создаём новый товар
-            sku_data = df[df['артикул'] == sku]
-            last_row = sku_data.sort_values('дата').iloc[-1]
-            
-            product = Product(
-                user_id=user_id,
-                sku=sku,
-                name=last_row['товар'],
-                current_stock=100,  # Дефолтное значение (можно улучшить)
-                unit_price=float(last_row['цена'])
-            )
-            db.add(product)
-            db.flush()
-
-        # Проверяем общее кол-во дней
-        existing_days = db.query(SalesHistory.date)\
-            .filter_by(product_id=product.id)\
-            .distinct().count()
-        
-        new_days = df[df['артикул'] == sku]['дата'].nunique()
-        total_days = existing_days + new_days
-
-        if total_days < 30:
-            raise ValueError(
-                f"Товар '{sku}': недостаточно данных ({total_days} дней, нужно ≥30)"
-            )
+        if sku in sku_to_pid:
+            continue
 
-    # Сохраняем продажи
-    for _, row in df.iterrows():
-        product = db.query(Product).filter_by(user_id=user_id, sku=row['артикул']).first()
-        
-        sale = SalesHistory(
+        # Создаём новый товар
+        last_row = last_rows.loc[sku]
+        product = Product(
             user_id=user_id,
-            product_id=product.id,
-            date=row['дата'],
-            quantity_sold=float(row['кол-во']),
-            sale_price=float(row['цена'])
+            sku=sku,
+            name=last_row['товар'],
+            current_stock=100,  # Дефолтное значение (можно улучшить)
+            unit_price=float(last_row['цена'])
         )
-        db.add(sale)
-        rows_loaded += 1
-        products_seen.add(product.id)
+        db.add(product)
+        new_products.append(product)
 
-    db.commit()
+    if new_products:
+        db.flush()
+        sku_to_pid.update({p.sku: p.id for p in new_products})
+
+    # Сохраняем продажи одним bulk INSERT (колонки извлекаются целиком)
+    # Повторная загрузка тех же дат обновляет записи (уникальный ключ user_id, product_id, date)
+    upsert = dialect_insert(db, SalesHistory)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=['user_id', 'product_id', 'date'],
+        set_={
+            'quantity_sold': upsert.excluded.quantity_sold,
+            'sale_price': upsert.excluded.sale_price
+        }
+    )
+
+    # Словари строк собираем порциями: память ограничена размером пакета,
+    # а запись остаётся одной транзакцией
+    df['product_id'] = df['артикул'].map(sku_to_pid)
+    for start in range(0, len(df), INGEST_BATCH_ROWS):
+        batch = df.iloc[start:start + INGEST_BATCH_ROWS]
+        db.execute(upsert, [
+            {
+                'user_id': user_id,
+                'product_id': pid,
+                'date': date,
+                'quantity_sold': q,
+                'sale_price': pr
+            }
+            for pid, date, q, pr in zip(
+                batch['product_id'].tolist(),
+                batch['дата'].tolist(),
+                batch['кол-во'].astype(float).tolist(),
+                batch['цена'].astype(float).tolist()
+            )
+        ])
+    rows_loaded = len(df)
+    products_seen = set(sku_to_pid.values())
 
-    # Прогнозирование
-    for product_id in products_seen:
-        _generate_forecast(db, user_id, product_id)
+    # Предрассчитанные агрегаты дашборда устарели — пересчитаются при чтении.
+    # Запись не удаляем, а обновляем updated_at: это версия данных для кэша ответов
+    # во всех воркерах API
+    stale = dialect_insert(db, DashboardCache).values(
+        user_id=user_id, payload={}, updated_at=datetime.utcnow()
+    )
+    db.execute(stale.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'payload': stale.excluded.payload, 'updated_at': stale.excluded.updated_at}
+    ))
+    db.commit()
 
-    return {
+    stats = {
         "rows_loaded": rows_loaded,
         "products_count": len(products_seen)
     }
+    return stats, list(products_seen)
 
 
-def _generate_forecast(db: Session, user_id: int, product_id: int):
-    """Генерация прогноза через Prophet"""
-    # Получаем историю
-    sales_data = db.query(SalesHistory.date, SalesHistory.quantity_sold)\
-        .filter_by(product_id=product_id)\
-        .order_by(SalesHistory.date)\
-        .all()
+def refresh_forecasts(user_id: int, product_ids: List[int]):
+    """
+    Пересчёт прогнозов вне HTTP-запроса (BackgroundTasks / очередь задач).
+    Открывает собственную сессию: сессия запроса к этому моменту уже закрыта.
+    """
+    db = SessionLocal()
+    try:
+        _generate_forecasts(db, product_ids)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Ошибка прогнозирования (user_id={user_id}): {e}")
+    finally:
+        db.close()
+
 
-    if len(sales_data) < 30:
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """
+    Разбор колонки дат целиком через pd.to_datetime.
+    Сначала ISO (2025-11-14), затем форматы с днём впереди (14.11.2025, 14/11/2025),
+    и только остаток — поэлементным разбором format='mixed'.
+    Невалидные значения -> NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values  # Arrow уже распознал даты
+
+    dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+
+    # Явный формат разбирается векторно в C, 'mixed' — по одному значению через dateutil
+    for fmt in _DAYFIRST_FORMATS:
+        rest = dates.isna() & values.notna()
+        if not rest.any():
+            return dates
+        dates[rest] = pd.to_datetime(values[rest], errors='coerce', format=fmt)
+
+    rest = dates.isna() & values.notna()
+    if rest.any():
+        dates[rest] = pd.to_datetime(
+            values[rest], errors='coerce', dayfirst=True, format='mixed'
+        )
+
+    return dates
+
+
+def _generate_forecasts(db: Session, product_ids: List[int]):
+    """Генерация прогнозов через Prophet для набора товаров (параллельно)"""
+    if not product_ids:
         return
 
-    # Подготовка для Prophet
-    df_prophet = pd.DataFrame(sales_data, columns=['ds', 'y'])
-    df_prophet['ds'] = pd.to_datetime(df_prophet['ds'])
+    # Получаем историю всех товаров одним запросом (строки-кортежи, без ORM-объектов)
+    sales_data = db.execute(
+        select(SalesHistory.product_id, SalesHistory.date, SalesHistory.quantity_sold)
+        .where(SalesHistory.product_id.in_(product_ids))
+        .order_by(SalesHistory.product_id, SalesHistory.date)
+    ).all()
+
+    # Колонки собираем один раз: даты сразу в datetime64 — воркеры получают
+    # числовые массивы вместо списков объектов date и не конвертируют их сами
+    product_col, date_col, qty_col = zip(*sales_data) if sales_data else ((), (), ())
+    sales_df = pd.DataFrame({
+        'product_id': np.asarray(product_col, dtype=np.int64),
+        'ds': pd.to_datetime(np.asarray(date_col, dtype='datetime64[D]')),
+        'y': np.asarray(qty_col, dtype=np.float64),
+    })
+    histories = {
+        pid: hist[['ds', 'y']].reset_index(drop=True)
+        for pid, hist in sales_df.groupby('product_id', sort=False)
+        if len(hist) >= 30
+    }
+
+    if not histories:
+        return
+
+    # Короткие ряды: Prophet их переобучает, считаем сезонный наивный прогноз
+    results = [
+        _seasonal_naive_forecast(pid, hist)
+        for pid, hist in histories.items()
+        if len(hist) < MIN_PROPHET_HISTORY_DAYS
+    ]
+
+    # Prophet.fit — основная стоимость; обучаем модели в отдельных процессах.
+    # Сессия БД в воркеры не передаётся — только данные.
+    long_histories = {
+        pid: hist for pid, hist in histories.items()
+        if len(hist) >= MIN_PROPHET_HISTORY_DAYS
+    }
+    if long_histories:
+        results += Parallel(n_jobs=-1, backend='loky')(
+            delayed(_fit_and_predict_safe)(pid, hist) for pid, hist in long_histories.items()
+        )
+
+    # Ошибка обучения одного товара не отменяет прогнозы остальных:
+    # у такого товара остаётся прежний прогноз
+    for pid, dates, error in results:
+        if dates is None:
+            print(f"❌ Прогноз товара {pid} не построен: {error}")
+    results = [result for result in results if result[1] is not None]
+    if not results:
+        return
+
+    # Удаляем старые прогнозы (избегаем дублей) одним DELETE
+    db.execute(
+        delete(Forecast).where(Forecast.product_id.in_([pid for pid, _, _ in results]))
+    )
+
+    # Сохраняем новые
+    db.bulk_insert_mappings(Forecast, [
+        {
+            'product_id': pid,
+            'forecast_date': forecast_date,
+            'predicted_quantity': max(0.0, yhat)  # Не даём отрицательные
+        }
+        for pid, dates, yhats in results
+        for forecast_date, yhat in zip(dates, yhats)
+    ])
+
+    db.commit()
+
 
-    # Обучение
-    model = Prophet(
+def _seasonal_naive_forecast(product_id: int, history: pd.DataFrame) -> Tuple[int, list, list]:
+    """Прогноз на 30 дней: средний недельный профиль за последние 4 недели"""
+    last_date = pd.Timestamp(history['ds'].iloc[-1])
+
+    # Дней без продаж в sales_history нет — восстанавливаем календарь последних
+    # 28 дней с нулями, чтобы профиль не смешивал дни недели. Первый из 28 дней
+    # приходится на тот же день недели, что и первый день прогноза.
+    window = pd.date_range(last_date - timedelta(days=27), last_date)
+    y = (
+        history.set_index(pd.to_datetime(history['ds']))['y']
+        .reindex(window, fill_value=0.0)
+        .to_numpy(dtype=float)
+    )
+    weekly_profile = y.reshape(4, 7).mean(axis=0)
+    yhat = np.tile(weekly_profile, 5)[:30]
+
+    future_dates = pd.date_range(last_date + timedelta(days=1), periods=30)
+
+    return (
+        int(product_id),
+        future_dates.date.tolist(),
+        yhat.tolist()
+    )
+
+
+def _new_prophet(yearly_seasonality: bool, n_changepoints: int) -> Prophet:
+    """Необученная модель Prophet с настройками проекта"""
+    return _SharedFeaturesProphet(
         daily_seasonality=False,
         weekly_seasonality=True,
-        yearly_seasonality=True,
-        interval_width=0.95
+        yearly_seasonality=yearly_seasonality,
+        n_changepoints=n_changepoints,
+        mcmc_samples=0,  # Только MAP-оценка
+        uncertainty_samples=0,  # Интервалы не сохраняем — сэмплирование не нужно
+        stan_backend='CMDSTANPY'
     )
-    model.fit(df_prophet)
 
-    # Прогноз на 30 дней
-    future = model.make_future_dataframe(periods=30)
+
+def _fit_and_predict_safe(product_id: int, history: pd.DataFrame) -> Tuple[int, Optional[list], Union[list, str]]:
+    """
+    _fit_and_predict для воркера Parallel: исключение не прерывает весь пакет,
+    а возвращается как (product_id, None, текст ошибки).
+    """
+    try:
+        return _fit_and_predict(product_id, history)
+    except Exception as e:
+        return int(product_id), None, f"{type(e).__name__}: {e}"
+
+
+def _fit_and_predict(product_id: int, history: pd.DataFrame) -> Tuple[int, list, list]:
+    """Обучает Prophet на истории одного товара и возвращает прогноз на 30 дней"""
+    # Подготовка для Prophet
+    df_prophet = history.copy()
+    df_prophet['ds'] = pd.to_datetime(df_prophet['ds'])
+
+    # Годовую сезонность включаем только при ≥2 лет истории,
+    # число точек излома — не больше одной на месяц данных.
+    # На коротких рядах Newton сходится за меньшее число шагов, чем LBFGS
+    span_days = (df_prophet['ds'].max() - df_prophet['ds'].min()).days
+    yearly_seasonality = span_days >= YEARLY_SEASONALITY_MIN_DAYS
+    n_changepoints = min(10, len(df_prophet) // 30)
+    algorithm = 'Newton' if len(df_prophet) < NEWTON_MAX_HISTORY_DAYS else 'LBFGS'
+
+    # Отпечаток истории (все даты и количества) и настроек обучения.
+    # Совпал — берём готовую модель из кэша, без повторного fit
+    fingerprint = hashlib.blake2b()
+    fingerprint.update(df_prophet['ds'].values.astype('datetime64[ns]').tobytes())
+    fingerprint.update(df_prophet['y'].to_numpy(dtype=np.float64).tobytes())
+    fingerprint.update(
+        f"{PROPHET_MODEL_VERSION}:{yearly_seasonality}:{n_changepoints}:{algorithm}".encode()
+    )
+    fingerprint = fingerprint.hexdigest()
+    # Один файл на товар: новая модель перезаписывает старую
+    cache_path = os.path.join(PROPHET_CACHE_DIR, f"{int(product_id)}.json")
+
+    model = _load_cached_model(cache_path, fingerprint)
+    if model is None:
+        model = _new_prophet(yearly_seasonality, n_changepoints)
+        try:
+            model.fit(df_prophet, algorithm=algorithm, iter=5000)
+        except Exception as e:
+            if algorithm == 'LBFGS':
+                raise
+            # Newton менее устойчив на плохо обусловленных задачах —
+            # повторяем обучение стандартным для Prophet LBFGS (модель нельзя обучить повторно)
+            print(f"⚠️ Newton не сошёлся для товара {product_id}, повтор с LBFGS: {e}")
+            model = _new_prophet(yearly_seasonality, n_changepoints)
+            model.fit(df_prophet, algorithm='LBFGS', iter=5000)
+        _save_cached_model(cache_path, fingerprint, model)
+
+    # Прогноз на 30 дней (только будущие даты, без повторного predict по истории)
+    future = model.make_future_dataframe(periods=30, include_history=False)
     forecast = model.predict(future)
 
-    # Удаляем старые прогнозы (избегаем дублей)
-    db.query(Forecast).filter_by(product_id=product_id).delete()
+    return (
+        int(product_id),
+        forecast['ds'].dt.date.tolist(),
+        forecast['yhat'].astype(float).tolist()
+    )
 
-    # Сохраняем новые
-    for _, row in forecast.tail(30).iterrows():
-        db_forecast = Forecast(
-            product_id=product_id,
-            forecast_date=row['ds'].date(),
-            predicted_quantity=max(0, row['yhat'])  # Не даём отрицательные
-        )
-        db.add(db_forecast)
 
-    db.commit()
\ No newline at end of file
+def _load_cached_model(path: str, fingerprint: str) -> Optional[Prophet]:
+    """
+    Загружает обученную модель товара из кэша.
+    None, если файла нет, он повреждён или модель обучена на другой истории.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            # Первая строка — отпечаток истории, дальше — модель в JSON
+            if f.readline().rstrip('\n') != fingerprint:
+                return None
+            return model_from_json(f.read())
+    except Exception as e:
+        print(f"⚠️ Не удалось прочитать кэш модели {path}: {e}")
+        return None
+
+
+def _save_cached_model(path: str, fingerprint: str, model: Prophet):
+    """Сохраняет обученную модель в кэш вместе с отпечатком (ошибки записи не критичны)"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{fingerprint}\n")
+            f.write(model_to_json(model))
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить модель в кэш {path}: {e}")
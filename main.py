@@ -3,28 +3,40 @@
 import os
 import io
 import re
+import time
+import tempfile
+import threading
+import aiofiles
+import aiofiles.os
+import aiofiles.tempfile
+import orjson
+import numpy as np
 import pandas as pd
-import random
-from datetime import datetime, timedelta
+import xlsxwriter
+from datetime import date, datetime, timedelta
 from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, BackgroundTasks, Request, Response
+from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, case, insert, select, literal, null, union_all
 
 from email_service import send_welcome_email
-from database import engine, get_db, Base
-from models import User, Product, SalesHistory, Forecast
-from utils import verify_password, get_password_hash
-
-# Создаем таблицы при запуске
-Base.metadata.create_all(bind=engine)
+from database import get_db, dialect_insert, SessionLocal
+from models import User, Product, SalesHistory, Forecast, DashboardCache
+from utils import (
+    ahash_password, verify_and_update_password, DUMMY_HASH,
+    create_access_token, decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+)
 
 app = FastAPI(
     title="MVP Прогноз спроса",
     description="Backend для прогнозирования спроса с ML",
-    version="1.0"
+    version="1.0",
+    default_response_class=ORJSONResponse  # Сериализация ответов через orjson
 )
 
 # CORS для фронтенда
@@ -36,38 +48,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Простая сессия (для MVP)
-ACTIVE_SESSIONS: dict[str, int] = {}
+# Размер блока при потоковом чтении загружаемых файлов
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 МБ
+# Строк продаж в одном пакете UPSERT при загрузке
+UPLOAD_BATCH_ROWS = 50_000
+# Каталог для временных копий загружаемых CSV. /tmp часто tmpfs (в RAM):
+# большой файл там удваивает расход памяти вместе с разбором — укажите
+# каталог на диске (например, /data/uploads на Render)
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', tempfile.gettempdir())
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Кэш ответов /dashboard и /products: ключ (раздел, user_id), TTL в секундах.
+# Кэш локален для процесса; чтобы воркеры не отдавали данные до загрузки,
+# каждая запись помнит версию данных пользователя — dashboard_cache.updated_at,
+# которую загрузка продаж обновляет в общей БД.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAXSIZE = 1024
+_response_cache = {}
+_response_cache_lock = threading.Lock()
+# (раздел, user_id) -> [Lock, число ожидающих]: один пересчёт на промах.
+# Запись удаляется, когда её больше никто не ждёт, — словарь не растёт
+_response_cache_build_locks = {}
+
+
+def _data_version(db: Session, user_id: int):
+    """Версия данных пользователя, общая для всех воркеров (одно чтение по первичному ключу)."""
+    return db.execute(
+        select(DashboardCache.updated_at).where(DashboardCache.user_id == user_id)
+    ).scalar()
+
+
+def _cache_get(namespace: str, user_id: int, version):
+    """Возвращает закэшированный ответ или None, если его нет, он устарел или версия данных другая."""
+    key = (namespace, user_id)
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, entry_version, payload = entry
+        if expires_at < time.monotonic() or entry_version != version:
+            del _response_cache[key]
+            return None
+        return payload
 
-def get_current_user_id(username: str) -> int:
-    """Проверяет авторизацию по глобальной сессии."""
-    if username not in ACTIVE_SESSIONS:
+
+def _cache_set(namespace: str, user_id: int, version, payload):
+    """Сохраняет ответ в кэш, вытесняя самые старые записи при переполнении."""
+    with _response_cache_lock:
+        while len(_response_cache) >= RESPONSE_CACHE_MAXSIZE:
+            del _response_cache[next(iter(_response_cache))]
+        _response_cache[(namespace, user_id)] = (
+            time.monotonic() + RESPONSE_CACHE_TTL, version, payload
+        )
+
+
+def _invalidate_user_cache(user_id: int):
+    """Сбрасывает все закэшированные ответы пользователя в текущем воркере."""
+    with _response_cache_lock:
+        for key in [k for k in _response_cache if k[1] == user_id]:
+            del _response_cache[key]
+
+
+def _cached_response(namespace: str, db: Session, user_id: int, build):
+    """
+    Ответ из кэша или build(). Одновременные промахи по одному ключу ждут
+    единственный пересчёт (без «штампеды» запросов к БД). Версия данных читается
+    до build(): результат, посчитанный во время загрузки, не пройдёт проверку
+    на следующем запросе.
+    """
+    version = _data_version(db, user_id)
+    cached = _cache_get(namespace, user_id, version)
+    if cached is not None:
+        return cached
+    
+    key = (namespace, user_id)
+    with _response_cache_lock:
+        entry = _response_cache_build_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    
+    try:
+        with entry[0]:
+            cached = _cache_get(namespace, user_id, version)
+            if cached is not None:
+                return cached
+            
+            result = build()
+            _cache_set(namespace, user_id, version, result)
+            return result
+    finally:
+        with _response_cache_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _response_cache_build_locks[key]
+
+
+# Авторизация: подписанный JWT в заголовке Authorization: Bearer или в cookie.
+# Состояние сессий на сервере не хранится — токен проверяет любой воркер.
+ACCESS_TOKEN_COOKIE = "access_token"
+# Cookie с токеном передаётся только по HTTPS (Secure): на Render включено
+# по умолчанию, при локальной разработке по http — выключено. Переопределяется COOKIE_SECURE=1/0
+ACCESS_TOKEN_COOKIE_SECURE = os.getenv("COOKIE_SECURE", "1" if os.getenv("RENDER") else "0") == "1"
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+
+def get_current_user_id(
+    request: Request,
+    bearer_token: Optional[str] = Depends(oauth2_scheme)
+) -> int:
+    """Проверяет авторизацию по токену доступа."""
+    token = bearer_token or request.cookies.get(ACCESS_TOKEN_COOKIE)
+    user_id = decode_access_token(token) if token else None
+    
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Требуется вход (login)"
+            detail="Требуется вход (login)",
+            headers={"WWW-Authenticate": "Bearer"}
         )
-    return ACTIVE_SESSIONS[username]
+    return user_id
+
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
 
 def is_valid_email(email: str) -> bool:
     """Проверка валидности email"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
+
+
+async def _send_welcome_email_safe(email: str, username: str, store_name: str):
+    """Фоновая отправка приветственного письма: ошибки SMTP только логируются"""
+    try:
+        await send_welcome_email(email, username, store_name)
+    except Exception as e:
+        print(f"⚠️ Ошибка отправки email: {e}")
 
 
 # ===== ENDPOINTS =====
 
+# Ответ /health сериализуется один раз при загрузке модуля
+_HEALTH_BODY = orjson.dumps({"status": "ok", "version": "1.0"})
+
+
 @app.get("/health")
-def health_check():
+async def health_check():
     """Проверка здоровья API."""
-    return {
-        "status": "ok",
-        "timestamp": datetime.utcnow().isoformat(),
-        "version": "1.0"
-    }
+    return Response(content=_HEALTH_BODY, media_type="application/json")
 
 
 @app.post("/register")
 async def register(
+    background_tasks: BackgroundTasks,
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
@@ -80,34 +210,32 @@ async def register(
     if not is_valid_email(email):
         raise HTTPException(status_code=400, detail="Некорректный формат email")
     
-    # Проверяем уникальность username
-    db_user = db.query(User).filter(User.username == username).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Пользователь с таким именем уже существует")
-    
-    # Проверяем уникальность email
-    db_email = db.query(User).filter(User.email == email).first()
-    if db_email:
-        raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
-    
     # Создаем нового пользователя
-    hashed_pw = get_password_hash(password)
+    hashed_pw = await ahash_password(password)
     new_user = User(
         username=username,
         email=email,
         password_hash=hashed_pw,
-        store_name=store_name,
-        created_at=datetime.utcnow()
+        store_name=store_name
     )
     db.add(new_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as e:
+        # Уникальность username и email проверяет БД (уникальные индексы) —
+        # без предварительных SELECT и без гонки при одновременной регистрации
+        db.rollback()
+        # Первая строка ошибки называет нарушенный индекс/колонку (значения — только в DETAIL)
+        violated = str(e.orig).splitlines()[0] if str(e.orig) else ""
+        if "username" in violated:
+            raise HTTPException(status_code=400, detail="Пользователь с таким именем уже существует")
+        if "email" in violated:
+            raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
+        raise
     db.refresh(new_user)
     
-    # Отправка приветственного email (не блокируем ответ)
-    try:
-        await send_welcome_email(email, username, store_name)
-    except Exception as e:
-        print(f"⚠️ Ошибка отправки email: {e}")
+    # Отправка приветственного email после ответа клиенту (не блокируем ответ)
+    background_tasks.add_task(_send_welcome_email_safe, email, username, store_name)
     
     return {
         "user_id": new_user.id,
@@ -119,6 +247,7 @@ async def register(
 
 @app.post("/login")
 def login(
+    response: Response,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
@@ -126,33 +255,214 @@ def login(
     """Вход в систему."""
     user = db.query(User).filter(User.username == username).first()
     
-    if not user or not verify_password(password, user.password_hash):
+    # bcrypt выполняется и для несуществующего пользователя — время ответа одинаковое
+    password_ok, new_hash = verify_and_update_password(
+        password, user.password_hash if user else DUMMY_HASH
+    )
+    
+    if not user or not password_ok:
         raise HTTPException(status_code=401, detail="Неверные учётные данные")
     
-    # Добавляем в активные сессии
-    ACTIVE_SESSIONS[username] = user.id
+    # Хеш с устаревшими параметрами пересчитываем при успешном входе
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+    
+    # Выдаём токен доступа (и дублируем его в httpOnly cookie для браузера)
+    access_token = create_access_token(user.id)
+    response.set_cookie(
+        ACCESS_TOKEN_COOKIE,
+        access_token,
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        httponly=True,
+        samesite="lax",
+        secure=ACCESS_TOKEN_COOKIE_SECURE
+    )
     
     return {
         "user_id": user.id,
         "username": username,
         "message": "Вход успешен",
-        "store_name": user.store_name
+        "store_name": user.store_name,
+        "access_token": access_token,
+        "token_type": "bearer"
     }
 
 
 @app.post("/logout")
-def logout(username: str = Form(...)):
-    """Выход из системы."""
-    if username in ACTIVE_SESSIONS:
-        del ACTIVE_SESSIONS[username]
+def logout(response: Response):
+    """Выход из системы (клиент забывает токен, cookie удаляется)."""
+    response.delete_cookie(
+        ACCESS_TOKEN_COOKIE,
+        httponly=True,
+        samesite="lax",
+        secure=ACCESS_TOKEN_COOKIE_SECURE
+    )
     
     return {"message": "Успешно вышли из системы"}
 
 
+def _process_sales_file(db: Session, user_id: int, tmp_path: str, filename: str) -> dict:
+    """Разбирает загруженный CSV и сохраняет продажи (блокирующая часть /upload-sales)."""
+    # Парсинг CSV: многопоточный парсер Arrow (даты ISO распознаются сразу),
+    # при неудаче — C-движок с явным указанием параметров
+    try:
+        df = pd.read_csv(
+            tmp_path,
+            encoding='utf-8',
+            sep=',',
+            engine='pyarrow'
+        )
+    except (ValueError, ImportError):
+        df = pd.read_csv(
+            tmp_path,
+            encoding='utf-8',
+            sep=',',
+            skipinitialspace=True
+        )
+    
+    # Удаление пробелов из названий колонок
+    df.columns = df.columns.str.strip()
+    
+    # Логирование для отладки
+    print("="*60)
+    print(f"📊 Загружен файл: {filename}")
+    print(f"📊 Найденные колонки: {list(df.columns)}")
+    print(f"📊 Количество строк: {len(df)}")
+    print("📊 Первые 3 строки:")
+    print(df.head(3))
+    print("="*60)
+    
+    # Проверка обязательных колонок
+    required_columns = ['date', 'product_id', 'quantity_sold']
+    missing = [col for col in required_columns if col not in df.columns]
+    
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Отсутствуют колонки: {missing}. Найдено: {list(df.columns)}"
+        )
+    
+    # Очистка данных
+    df = df[required_columns].dropna()
+    
+    # Arrow не поддерживает skipinitialspace — убираем пробелы в строковых значениях
+    for col in ('date', 'product_id'):
+        if pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].str.strip()
+    
+    # Преобразование типов (для колонок, уже типизированных Arrow, — без повторного разбора)
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
+    df['quantity_sold'] = pd.to_numeric(df['quantity_sold'])
+    
+    # Сохранение в БД — набором запросов вместо SELECT/INSERT на каждую строку
+    df['product_id'] = df['product_id'].astype(str)
+    df['sale_date'] = df['date'].dt.date
+    # Повтор товара и даты в файле — берём последнюю строку
+    df = df.drop_duplicates(subset=['product_id', 'sale_date'], keep='last')
+    
+    skus = df['product_id'].unique().tolist()
+    
+    # 1. Существующие товары пользователя — одним запросом
+    sku_to_pid = dict(
+        db.query(Product.sku, Product.id).filter(
+            Product.user_id == user_id,
+            Product.sku.in_(skus)
+        ).all()
+    )
+    
+    # 2. Недостающие товары — одним INSERT
+    new_skus = [sku for sku in skus if sku not in sku_to_pid]
+    products_created = len(new_skus)
+    
+    if new_skus:
+        db.execute(insert(Product), [
+            {
+                "user_id": user_id,
+                "sku": sku,
+                "name": f"Товар {sku}",
+                "current_stock": 0,
+                "unit_price": 100.0
+            }
+            for sku in new_skus
+        ])
+        sku_to_pid.update(
+            db.query(Product.sku, Product.id).filter(
+                Product.user_id == user_id,
+                Product.sku.in_(new_skus)
+            ).all()
+        )
+        print(f"✅ Создано товаров: {new_skus}")
+    
+    df['pid'] = df['product_id'].map(sku_to_pid)
+    products_updated = set(df['pid'].tolist())
+    
+    # 3. Продажи — UPSERT по уникальному ключу (user_id, product_id, date):
+    # новые дни добавляются, повторно загруженные обновляют количество.
+    # Словари строк собираем порциями — память не растёт с размером файла,
+    # а транзакция остаётся одной на весь файл
+    upsert = dialect_insert(db, SalesHistory)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=['user_id', 'product_id', 'date'],
+        set_={'quantity_sold': upsert.excluded.quantity_sold}
+    )
+    
+    for start in range(0, len(df), UPLOAD_BATCH_ROWS):
+        batch = df.iloc[start:start + UPLOAD_BATCH_ROWS]
+        db.execute(upsert, [
+            {
+                "user_id": user_id,
+                "product_id": pid,
+                "date": sale_date,
+                "quantity_sold": qty,
+                "sale_price": 100.0
+            }
+            for pid, sale_date, qty in zip(
+                batch['pid'].tolist(), batch['sale_date'].tolist(), batch['quantity_sold'].astype(float).tolist()
+            )
+        ])
+    
+    records_added = len(df)
+    
+    # Агрегаты дашборда пересчитываем один раз при записи, а не на каждом чтении
+    _refresh_dashboard_aggregates(db, user_id)
+    db.commit()
+    _invalidate_user_cache(user_id)
+    
+    print(f"✅ Загружено записей: {records_added}")
+    print(f"✅ Создано товаров: {products_created}")
+    print(f"✅ Обновлено товаров: {len(products_updated)}")
+    
+    return {
+        "status": "success",
+        "message": "✅ Данные успешно загружены",
+        "rows_loaded": records_added,
+        "products_count": df['product_id'].nunique(),
+        "products_created": products_created,
+        "date_range": {
+            "start": df['date'].min().strftime('%Y-%m-%d'),
+            "end": df['date'].max().strftime('%Y-%m-%d')
+        }
+    }
+
+
+def _warm_user_cache(user_id: int):
+    """Заранее наполняет кэш /dashboard и /products после загрузки продаж."""
+    db = SessionLocal()
+    try:
+        _cached_response("dashboard", db, user_id, lambda: _build_dashboard(db, user_id))
+        _cached_response("products", db, user_id, lambda: _list_products(db, user_id))
+    except Exception as e:
+        print(f"⚠️ Не удалось прогреть кэш дашборда для пользователя {user_id}: {e}")
+    finally:
+        db.close()
+
+
 @app.post("/upload-sales")
 async def upload_sales(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    username: str = Form(...),
+    user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """
@@ -160,122 +470,30 @@ async def upload_sales(
     Ожидаемый формат: date,product_id,quantity_sold
     Пример: 2025-11-14,SKU001,170
     """
-    user_id = get_current_user_id(username)
-    
-    # Проверка расширения файла
-    if not file.filename.endswith('.csv'):
+    # Проверка расширения файла (без учёта регистра: SALES.CSV тоже подходит)
+    # до записи на диск и разбора
+    if os.path.splitext(file.filename or "")[1].lower() != '.csv':
         raise HTTPException(
             status_code=400,
             detail="Файл должен быть в формате CSV"
         )
     
+    tmp_path = None
+    
     try:
-        # Чтение содержимого файла
-        contents = await file.read()
-        
-        # Парсинг CSV с явным указанием параметров
-        df = pd.read_csv(
-            io.BytesIO(contents),
-            encoding='utf-8',
-            sep=',',
-            skipinitialspace=True
-        )
-        
-        # Удаление пробелов из названий колонок
-        df.columns = df.columns.str.strip()
-        
-        # Логирование для отладки
-        print("="*60)
-        print(f"📊 Загружен файл: {file.filename}")
-        print(f"📊 Найденные колонки: {list(df.columns)}")
-        print(f"📊 Количество строк: {len(df)}")
-        print("📊 Первые 3 строки:")
-        print(df.head(3))
-        print("="*60)
-        
-        # Проверка обязательных колонок
-        required_columns = ['date', 'product_id', 'quantity_sold']
-        missing = [col for col in required_columns if col not in df.columns]
-        
-        if missing:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Отсутствуют колонки: {missing}. Найдено: {list(df.columns)}"
-            )
-        
-        # Очистка данных
-        df = df[required_columns].dropna()
+        # Потоковая запись загрузки во временный файл (без буфера на весь файл в памяти)
+        async with aiofiles.tempfile.NamedTemporaryFile('wb', suffix='.csv', dir=UPLOAD_DIR, delete=False) as tmp:
+            tmp_path = tmp.name
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await tmp.write(chunk)
         
-        # Преобразование типов
-        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
-        df['quantity_sold'] = pd.to_numeric(df['quantity_sold'])
+        # Разбор CSV и запись в БД блокируют — выполняем в пуле потоков,
+        # чтобы не останавливать event loop для остальных запросов воркера
+        result = await run_in_threadpool(_process_sales_file, db, user_id, tmp_path, file.filename)
         
-        # Сохранение в БД
-        records_added = 0
-        products_created = 0
-        products_updated = set()
-        
-        for _, row in df.iterrows():
-            # Проверка/создание товара
-            product = db.query(Product).filter(
-                Product.sku == row['product_id'],
-                Product.user_id == user_id
-            ).first()
-            
-            if not product:
-                product = Product(
-                    user_id=user_id,
-                    sku=row['product_id'],
-                    name=f"Товар {row['product_id']}",
-                    current_stock=0,
-                    unit_price=100.0
-                )
-                db.add(product)
-                db.flush()
-                products_created += 1
-                print(f"✅ Создан товар: {row['product_id']}")
-            
-            products_updated.add(product.id)
-            
-            # Проверка: нет ли уже такой записи продажи
-            existing_sale = db.query(SalesHistory).filter(
-                SalesHistory.user_id == user_id,
-                SalesHistory.product_id == product.id,
-                SalesHistory.date == row['date'].date()
-            ).first()
-            
-            if existing_sale:
-                # Обновляем существующую запись
-                existing_sale.quantity_sold = float(row['quantity_sold'])
-            else:
-                # Добавление новой записи продажи
-                sale = SalesHistory(
-                    user_id=user_id,
-                    product_id=product.id,
-                    date=row['date'].date(),
-                    quantity_sold=float(row['quantity_sold']),
-                    sale_price=100.0
-                )
-                db.add(sale)
-                records_added += 1
-        
-        db.commit()
-        
-        print(f"✅ Загружено записей: {records_added}")
-        print(f"✅ Создано товаров: {products_created}")
-        print(f"✅ Обновлено товаров: {len(products_updated)}")
-        
-        return {
-            "status": "success",
-            "message": "✅ Данные успешно загружены",
-            "rows_loaded": records_added,
-            "products_count": df['product_id'].nunique(),
-            "products_created": products_created,
-            "date_range": {
-                "start": df['date'].min().strftime('%Y-%m-%d'),
-                "end": df['date'].max().strftime('%Y-%m-%d')
-            }
-        }
+        # Дашборд пересчитываем сразу после ответа — первый заход после загрузки без ожидания
+        background_tasks.add_task(_warm_user_cache, user_id)
+        return result
         
     except HTTPException:
         raise
@@ -288,37 +506,150 @@ async def upload_sales(
             status_code=500,
             detail=f"Ошибка при обработке файла: {str(e)}"
         )
+    finally:
+        if tmp_path and await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
 
 
 @app.get("/products")
-def list_products(username: str, db: Session = Depends(get_db)):
+def list_products(
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
     """Список всех товаров пользователя."""
-    user_id = get_current_user_id(username)
-    
-    products = db.query(Product).filter(Product.user_id == user_id).all()
+    return _cached_response("products", db, user_id, lambda: _list_products(db, user_id))
+
+
+def _list_products(db: Session, user_id: int) -> dict:
+    """Читает список товаров из БД (без кэша)."""
+    # Только колонки (Row), без ORM-объектов и identity map
+    products = db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.current_stock,
+            Product.unit_price
+        ).where(Product.user_id == user_id)
+    ).all()
     
     return {
         "count": len(products),
-        "products": [
-            {
-                "id": p.id,
-                "name": p.name,
-                "sku": p.sku,
-                "current_stock": p.current_stock,
-                "unit_price": p.unit_price
-            }
-            for p in products
-        ]
+        "products": [dict(p._mapping) for p in products]
+    }
+
+
+def _dashboard_aggregates(db: Session, user_id: int, sixty_days_ago, thirty_days_ago):
+    """
+    Агрегаты дашборда одним UNION ALL (один round-trip к БД, работает и в SQLite):
+    - сумма продаж по дням за 60 дней,
+    - средние продажи по товарам за 30 дней,
+    - общее число записей продаж пользователя.
+    """
+    by_date = select(
+        literal("date").label("kind"),
+        SalesHistory.date.label("day"),
+        null().label("product_id"),
+        func.sum(SalesHistory.quantity_sold).label("value")
+    ).where(
+        SalesHistory.user_id == user_id,
+        SalesHistory.date >= sixty_days_ago
+    ).group_by(SalesHistory.date)
+    
+    by_product = select(
+        literal("product"),
+        null(),
+        SalesHistory.product_id,
+        func.avg(SalesHistory.quantity_sold)
+    ).where(
+        SalesHistory.user_id == user_id,
+        SalesHistory.date >= thirty_days_ago
+    ).group_by(SalesHistory.product_id)
+    
+    total = select(
+        literal("total"),
+        null(),
+        null(),
+        func.count(SalesHistory.id)
+    ).where(SalesHistory.user_id == user_id)
+    
+    sales_by_date, avg_rows, total_records = [], [], 0
+    for kind, day, product_id, value in db.execute(union_all(by_date, by_product, total)):
+        if kind == "date":
+            sales_by_date.append((day, value))
+        elif kind == "product":
+            avg_rows.append((product_id, value))
+        else:
+            total_records = int(value or 0)
+    
+    sales_by_date.sort(key=lambda row: row[0])
+    return sales_by_date, avg_rows, total_records
+
+
+def _refresh_dashboard_aggregates(db: Session, user_id: int):
+    """Пересчитывает агрегаты дашборда и сохраняет их в dashboard_cache (без commit)."""
+    today = datetime.utcnow().date()
+    sales_by_date, avg_rows, total_records = _dashboard_aggregates(
+        db, user_id, today - timedelta(days=60), today - timedelta(days=30)
+    )
+    
+    payload = {
+        "day": today.isoformat(),
+        "sales_by_date": [[d.isoformat(), float(total)] for d, total in sales_by_date],
+        "avg_by_product": [[pid, float(avg or 0)] for pid, avg in avg_rows],
+        "total_records": total_records
     }
+    stmt = dialect_insert(db, DashboardCache).values(
+        user_id=user_id, payload=payload, updated_at=datetime.utcnow()
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"payload": stmt.excluded.payload, "updated_at": stmt.excluded.updated_at}
+    ))
+    return sales_by_date, avg_rows, total_records
+
+
+def _load_dashboard_aggregates(db: Session, user_id: int):
+    """
+    Агрегаты дашборда из dashboard_cache — одно чтение по первичному ключу.
+    Окна 30/60 дней считаются от текущей даты, поэтому запись за прошлый день
+    (или ее отсутствие) пересчитывается.
+    """
+    cached = db.get(DashboardCache, user_id)
+    if cached is not None and cached.payload.get("day") == datetime.utcnow().date().isoformat():
+        payload = cached.payload
+        return (
+            [(date.fromisoformat(d), total) for d, total in payload["sales_by_date"]],
+            [tuple(row) for row in payload["avg_by_product"]],
+            payload["total_records"]
+        )
+    
+    result = _refresh_dashboard_aggregates(db, user_id)
+    db.commit()
+    return result
 
 
 @app.get("/dashboard")
-def dashboard(username: str, db: Session = Depends(get_db)):
+def dashboard(
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
     """Главный дашборд с реальной аналитикой из загруженных данных."""
-    user_id = get_current_user_id(username)
-    
-    # Получаем все товары пользователя
-    products = db.query(Product).filter(Product.user_id == user_id).all()
+    return _cached_response("dashboard", db, user_id, lambda: _build_dashboard(db, user_id))
+
+
+def _build_dashboard(db: Session, user_id: int) -> dict:
+    """Считает данные дашборда (без кэша)."""
+    # Получаем все товары пользователя — только нужные колонки, без ORM-объектов
+    products = db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.current_stock,
+            Product.unit_price
+        ).where(Product.user_id == user_id)
+    ).all()
     
     if not products:
         return {
@@ -333,97 +664,65 @@ def dashboard(username: str, db: Session = Depends(get_db)):
         }
     
     # ========== 1. РЕАЛЬНАЯ ИСТОРИЯ ПРОДАЖ ИЗ БД ==========
-    sixty_days_ago = datetime.utcnow().date() - timedelta(days=60)
-    
-    sales_by_date = db.query(
-        SalesHistory.date,
-        func.sum(SalesHistory.quantity_sold).label('total_sold')
-    ).filter(
-        SalesHistory.user_id == user_id,
-        SalesHistory.date >= sixty_days_ago
-    ).group_by(
-        SalesHistory.date
-    ).order_by(
-        SalesHistory.date
-    ).all()
+    # История по дням, средние по товарам и общее число записей —
+    # предрассчитаны при загрузке продаж
+    sales_by_date, avg_rows, total_sales_records = _load_dashboard_aggregates(db, user_id)
     
     # Формируем данные для графика (фактические продажи)
     sales_history = [
         {
-            "date": sale.date.strftime("%d.%m.%Y"),
-            "actual": float(sale.total_sold)
+            "date": sale_date.strftime("%d.%m.%Y"),
+            "actual": float(total_sold)
         }
-        for sale in sales_by_date
+        for sale_date, total_sold in sales_by_date
     ]
     
     # ========== 2. ВЫЧИСЛЕНИЕ СРЕДНЕГО СПРОСА ==========
-    thirty_days_ago = datetime.utcnow().date() - timedelta(days=30)
+    avg_sales_by_product = {pid: float(avg or 0) for pid, avg in avg_rows}
     
-    avg_sales_by_product = {}
-    for product in products:
-        avg_sales = db.query(
-            func.avg(SalesHistory.quantity_sold)
-        ).filter(
-            SalesHistory.product_id == product.id,
-            SalesHistory.date >= thirty_days_ago
-        ).scalar()
-        
-        avg_sales_by_product[product.id] = float(avg_sales or 0)
+    # Таблица товаров для векторных расчетов (без Python-циклов по товарам)
+    pdf = pd.DataFrame.from_records(
+        products,
+        columns=["product_id", "name", "sku", "current_stock", "unit_price"]
+    )
+    pdf["avg_daily_sales"] = pdf["product_id"].map(avg_sales_by_product).fillna(0.0).astype(float)
+    
+    # Дни до исчерпания запасов (без продаж — 999)
+    has_sales = pdf["avg_daily_sales"] > 0
+    pdf["days"] = np.where(
+        has_sales,
+        pdf["current_stock"] / pdf["avg_daily_sales"].where(has_sales, 1.0),
+        999
+    )
     
     # ========== 3. РАСЧЕТ РИСКА ДЕФИЦИТА ==========
-    risk_total = 0
-    critical_products = []
-    
-    for product in products:
-        avg_daily_sales = avg_sales_by_product[product.id]
-        
-        # Дни до исчерпания запасов
-        if avg_daily_sales > 0:
-            days_until_stockout = product.current_stock / avg_daily_sales
-        else:
-            days_until_stockout = 999
-        
-        # Критический уровень: меньше 7 дней запаса
-        if days_until_stockout < 7:
-            risk_value = product.current_stock * product.unit_price
-            risk_total += risk_value
-            
-            critical_products.append({
-                "product_id": product.id,
-                "name": product.name,
-                "sku": product.sku,
-                "current_stock": product.current_stock,
-                "avg_daily_sales": round(avg_daily_sales, 1),
-                "days_left": int(days_until_stockout),
-                "stock_value": round(risk_value, 2)
-            })
+    # Критический уровень: меньше 7 дней запаса
+    critical = pdf[pdf["days"] < 7].copy()
+    critical["stock_value"] = critical["current_stock"] * critical["unit_price"]
+    risk_total = float(critical["stock_value"].sum())
+    
+    critical["avg_daily_sales"] = critical["avg_daily_sales"].round(1)
+    critical["days_left"] = critical["days"].astype(int)
+    critical["stock_value"] = critical["stock_value"].round(2)
+    critical_products = critical[[
+        "product_id", "name", "sku", "current_stock",
+        "avg_daily_sales", "days_left", "stock_value"
+    ]].to_dict("records")
     
     # ========== 4. РАСЧЕТ ИЗЛИШКОВ ==========
-    overstock_total = 0
-    overstock_products = []
-    
-    for product in products:
-        avg_daily_sales = avg_sales_by_product[product.id]
-        
-        # Излишек: запас на > 60 дней
-        if avg_daily_sales > 0:
-            days_of_stock = product.current_stock / avg_daily_sales
-            
-            if days_of_stock > 60:
-                optimal_stock = avg_daily_sales * 30
-                excess_qty = product.current_stock - optimal_stock
-                overstock_value = excess_qty * product.unit_price
-                overstock_total += overstock_value
-                
-                overstock_products.append({
-                    "product_id": product.id,
-                    "name": product.name,
-                    "sku": product.sku,
-                    "current_stock": product.current_stock,
-                    "days_of_stock": int(days_of_stock),
-                    "excess_qty": int(excess_qty),
-                    "overstock_value": round(overstock_value, 2)
-                })
+    # Излишек: запас на > 60 дней
+    overstock = pdf[has_sales & (pdf["days"] > 60)].copy()
+    overstock["excess_qty"] = overstock["current_stock"] - overstock["avg_daily_sales"] * 30
+    overstock["overstock_value"] = overstock["excess_qty"] * overstock["unit_price"]
+    overstock_total = float(overstock["overstock_value"].sum())
+    
+    overstock["days_of_stock"] = overstock["days"].astype(int)
+    overstock["excess_qty"] = overstock["excess_qty"].astype(int)
+    overstock["overstock_value"] = overstock["overstock_value"].round(2)
+    overstock_products = overstock[[
+        "product_id", "name", "sku", "current_stock",
+        "days_of_stock", "excess_qty", "overstock_value"
+    ]].to_dict("records")
     
     # ========== 5. ПРОСТОЙ ПРОГНОЗ НА 30 ДНЕЙ ==========
     forecast_data = []
@@ -432,47 +731,30 @@ def dashboard(username: str, db: Session = Depends(get_db)):
         recent_sales = sales_history[-7:]
         avg_recent = sum(s["actual"] for s in recent_sales) / len(recent_sales)
         
-        last_date = datetime.strptime(sales_history[-1]["date"], "%d.%m.%Y")
+        # Последняя дата уже есть как date — без повторного strptime
+        last_date = sales_by_date[-1][0]
+        forecast_values = avg_recent * np.random.uniform(0.9, 1.1, 30)
         
-        for i in range(1, 31):
-            forecast_date = last_date + timedelta(days=i)
-            noise = random.uniform(0.9, 1.1)
-            forecast_value = avg_recent * noise
-            
-            forecast_data.append({
-                "date": forecast_date.strftime("%d.%m.%Y"),
-                "forecast": round(forecast_value, 1)
-            })
+        forecast_data = [
+            {
+                "date": (last_date + timedelta(days=i)).strftime("%d.%m.%Y"),
+                "forecast": round(float(value), 1)
+            }
+            for i, value in enumerate(forecast_values, start=1)
+        ]
     
     # ========== 6. РЕКОМЕНДАЦИИ ПО ЗАКУПКАМ ==========
-    recommendations = []
+    # Закупка на 37 дней (30 дней + 7 дней страхового запаса)
+    critical["suggested_qty"] = (critical["avg_daily_sales"] * 37).astype(int)
+    critical["cost"] = (critical["suggested_qty"] * critical["unit_price"]).round(2)
+    critical["priority"] = np.where(critical["days_left"] < 3, "СРОЧНО", "ВЫСОКИЙ")
     
-    for p in critical_products:
-        avg_daily = p["avg_daily_sales"]
-        suggested_qty = int(avg_daily * 37)
-        
-        product_obj = next((pr for pr in products if pr.id == p["product_id"]), None)
-        cost = suggested_qty * product_obj.unit_price if product_obj else 0
-        
-        recommendations.append({
-            "product_id": p["product_id"],
-            "name": p["name"],
-            "sku": p["sku"],
-            "current_stock": p["current_stock"],
-            "avg_daily_sales": p["avg_daily_sales"],
-            "days_left": p["days_left"],
-            "suggested_qty": suggested_qty,
-            "cost": round(cost, 2),
-            "priority": "СРОЧНО" if p["days_left"] < 3 else "ВЫСОКИЙ"
-        })
-    
-    recommendations.sort(key=lambda x: x["days_left"])
+    recommendations = critical.sort_values("days_left", kind="stable")[[
+        "product_id", "name", "sku", "current_stock", "avg_daily_sales",
+        "days_left", "suggested_qty", "cost", "priority"
+    ]].to_dict("records")
     
     # ========== 7. ИТОГОВАЯ СТАТИСТИКА ==========
-    total_sales_records = db.query(SalesHistory).filter(
-        SalesHistory.user_id == user_id
-    ).count()
-    
     if total_sales_records > 100:
         forecast_accuracy = "94%"
     elif total_sales_records > 50:
@@ -504,15 +786,21 @@ def dashboard(username: str, db: Session = Depends(get_db)):
 @app.get("/product/{product_id}")
 def product_detail(
     product_id: int,
-    username: str,
+    user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
     """Детальная информация о товаре с реальной аналитикой."""
-    user_id = get_current_user_id(username)
-    
-    product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.user_id == user_id
+    product = db.execute(
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.current_stock,
+            Product.unit_price
+        ).where(
+            Product.id == product_id,
+            Product.user_id == user_id
+        )
     ).first()
     
     if not product:
@@ -521,7 +809,11 @@ def product_detail(
     # ========== 1. ИСТОРИЯ ПРОДАЖ ТОВАРА ==========
     sixty_days_ago = datetime.utcnow().date() - timedelta(days=60)
     
-    sales_history = db.query(SalesHistory).filter(
+    # Только нужные колонки — без построения ORM-объектов на каждую строку
+    sales_history = db.query(
+        SalesHistory.date,
+        SalesHistory.quantity_sold
+    ).filter(
         SalesHistory.product_id == product_id,
         SalesHistory.date >= sixty_days_ago
     ).order_by(SalesHistory.date).all()
@@ -537,12 +829,16 @@ def product_detail(
     # ========== 2. ВЫЧИСЛЕНИЕ СРЕДНЕГО СПРОСА ==========
     thirty_days_ago = datetime.utcnow().date() - timedelta(days=30)
     
-    avg_sales = db.query(
-        func.avg(SalesHistory.quantity_sold)
+    # Средний спрос за 30 дней и статистика за 60 дней — одним агрегатом в БД
+    avg_sales, total_sold, max_sale, min_sale = db.query(
+        func.avg(case((SalesHistory.date >= thirty_days_ago, SalesHistory.quantity_sold))),
+        func.sum(SalesHistory.quantity_sold),
+        func.max(SalesHistory.quantity_sold),
+        func.min(SalesHistory.quantity_sold)
     ).filter(
         SalesHistory.product_id == product_id,
-        SalesHistory.date >= thirty_days_ago
-    ).scalar()
+        SalesHistory.date >= sixty_days_ago
+    ).one()
     
     avg_daily_sales = float(avg_sales or 0)
     
@@ -552,17 +848,17 @@ def product_detail(
     if avg_daily_sales > 0:
         last_date = sales_history[-1].date if sales_history else datetime.utcnow().date()
         
-        for i in range(1, 31):
-            forecast_date = last_date + timedelta(days=i)
-            noise = random.uniform(0.85, 1.15)
-            forecast_value = avg_daily_sales * noise
-            
-            forecast_30_days.append({
-                "date": forecast_date.strftime("%d.%m"),
-                "yhat": round(forecast_value, 1),
-                "yhat_lower": round(forecast_value * 0.8, 1),
-                "yhat_upper": round(forecast_value * 1.2, 1)
-            })
+        forecast_values = avg_daily_sales * np.random.uniform(0.85, 1.15, 30)
+        
+        forecast_30_days = [
+            {
+                "date": (last_date + timedelta(days=i)).strftime("%d.%m"),
+                "yhat": round(float(value), 1),
+                "yhat_lower": round(float(value) * 0.8, 1),
+                "yhat_upper": round(float(value) * 1.2, 1)
+            }
+            for i, value in enumerate(forecast_values, start=1)
+        ]
     
     # ========== 4. РАСЧЕТ ДНЕЙ ДО ИСЧЕРПАНИЯ ==========
     if avg_daily_sales > 0:
@@ -601,11 +897,6 @@ def product_detail(
     if days_until_stockout > 60:
         factors.append("📦 Избыточные запасы")
     
-    # ========== 7. СТАТИСТИКА ==========
-    total_sold = sum(s.quantity_sold for s in sales_history)
-    max_sale = max((s.quantity_sold for s in sales_history), default=0)
-    min_sale = min((s.quantity_sold for s in sales_history), default=0)
-    
     return {
         "product_id": product.id,
         "product_name": product.name,
@@ -626,61 +917,104 @@ def product_detail(
             "suggested_order": suggested_order
         },
         "statistics": {
-            "total_sold_60d": int(total_sold),
+            "total_sold_60d": int(total_sold or 0),
             "avg_daily": round(avg_daily_sales, 1),
-            "max_daily": float(max_sale),
-            "min_daily": float(min_sale),
+            "max_daily": float(max_sale or 0),
+            "min_daily": float(min_sale or 0),
             "records_count": len(sales_history)
         }
     }
 
 
+EXPORT_COLUMNS = [
+    "Артикул",
+    "Товар",
+    "Текущий остаток (шт)",
+    "Цена за единицу (₽)",
+    "Стоимость остатка (₽)",
+    "Рекомендуемая закупка (шт)",
+    "Сумма закупки (₽)"
+]
+
+
+def _build_export_xlsx(db: Session, user_id: int) -> Optional[bytes]:
+    """Собирает Excel-отчет по товарам пользователя (None — товаров нет)."""
+    # Товары читаются порциями по 500 строк без ORM-объектов
+    products = db.execute(
+        select(
+            Product.sku,
+            Product.name,
+            Product.current_stock,
+            Product.unit_price
+        ).where(Product.user_id == user_id).execution_options(yield_per=500)
+    )
+    
+    # xlsxwriter в режиме constant_memory сбрасывает строки листа во временный
+    # файл по мере записи; кладём его в UPLOAD_DIR (на диске), а не в /tmp.
+    # Итоговый xlsx собирается в памяти
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True, "tmpdir": UPLOAD_DIR})
+    worksheet = workbook.add_worksheet()
+    
+    worksheet.write_row(0, 0, EXPORT_COLUMNS, workbook.add_format({"bold": True, "border": 1}))
+    row_idx = 0
+    for row_idx, (sku, name, current_stock, unit_price) in enumerate(products, start=1):
+        worksheet.write_row(row_idx, 0, [
+            sku,
+            name,
+            current_stock,
+            unit_price,
+            current_stock * unit_price,
+            100,
+            100 * unit_price
+        ])
+    
+    workbook.close()
+    return buffer.getvalue() if row_idx else None
+
+
 @app.get("/export-excel")
-def export_excel(username: str, db: Session = Depends(get_db)):
+def export_excel(
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
     """Экспортирует рекомендации в Excel."""
-    user_id = get_current_user_id(username)
-    
-    products = db.query(Product).filter(Product.user_id == user_id).all()
-    
-    if not products:
-        raise HTTPException(status_code=404, detail="Нет товаров для экспорта")
-    
     try:
-        from openpyxl.styles import Font, PatternFill
-        
-        # Подготавливаем данные
-        data = []
-        for product in products:
-            data.append({
-                "Артикул": product.sku,
-                "Товар": product.name,
-                "Текущий остаток (шт)": product.current_stock,
-                "Цена за единицу (₽)": product.unit_price,
-                "Стоимость остатка (₽)": product.current_stock * product.unit_price,
-                "Рекомендуемая закупка (шт)": 100,
-                "Сумма закупки (₽)": 100 * product.unit_price
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # Сохраняем в Excel
-        export_path = f"/tmp/forecast_report_{user_id}.xlsx"
-        df.to_excel(export_path, index=False, engine='openpyxl')
-        
-        return FileResponse(
-            export_path,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=f"forecast_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        )
+        # Файл не кэшируется: xlsx большого каталога занимал бы память каждого воркера
+        content = _build_export_xlsx(db, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при экспорте: {str(e)}")
+    
+    if content is None:
+        raise HTTPException(status_code=404, detail="Нет товаров для экспорта")
+    
+    filename = f"forecast_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return Response(
+        content,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
+    from migrate import migrate
+    # Схема БД создаётся и обновляется один раз, до запуска воркеров (как на Render)
+    migrate()
+    # Несколько процессов-воркеров: для запуска с workers uvicorn нужна строка импорта.
+    # uvloop и httptools ставятся вместе с uvicorn[standard]
+    workers = int(os.getenv("WEB_CONCURRENCY", 2))
+    if workers > 1 and not os.getenv("SECRET_KEY"):
+        # Без общего SECRET_KEY каждый воркер подписывал бы токены своим ключом,
+        # и токен одного воркера отклонялся бы другим
+        print("⚠️ SECRET_KEY не задан: запускаем один воркер вместо нескольких")
+        workers = 1
     uvicorn.run(
-        app,
+        "main:app",
         host="0.0.0.0",
         port=8000,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
@@ -0,0 +1,129 @@
+# migrate.py
+"""
+Создание и обновление схемы БД. Воркеры API схему не трогают: DDL выполняется
+один раз, в одном процессе, до старта uvicorn: python migrate.py
+"""
+
+from sqlalchemy import MetaData, delete, func, inspect, select, text
+from sqlalchemy.schema import CreateTable
+
+from database import engine, Base
+from models import User, Product, SalesHistory, Forecast
+
+SALES_UNIQUE_INDEX = "uq_sales_uid_pid_date"
+
+
+def dedupe_sales_history() -> int:
+    """
+    Удаляет дубли продаж (user_id, product_id, date), оставляя последнюю запись,
+    и создаёт уникальный индекс для UPSERT. Возвращает число удалённых строк.
+    """
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(SalesHistory.__tablename__)}
+    if SALES_UNIQUE_INDEX in existing:
+        return 0
+
+    unique_index = next(ix for ix in SalesHistory.__table__.indexes if ix.name == SALES_UNIQUE_INDEX)
+    with engine.begin() as conn:
+        latest_ids = select(func.max(SalesHistory.id)).group_by(
+            SalesHistory.user_id, SalesHistory.product_id, SalesHistory.date
+        )
+        deleted = conn.execute(
+            delete(SalesHistory).where(SalesHistory.id.not_in(latest_ids))
+        ).rowcount
+        unique_index.create(bind=conn)
+
+    print(f"✅ Удалено дублей продаж: {deleted}; создан индекс {SALES_UNIQUE_INDEX}")
+    return deleted
+
+
+def ensure_indexes():
+    """Досоздаёт индексы из models.py в уже существующих таблицах (create_all их не добавляет)."""
+    with engine.begin() as conn:
+        for table in (Product.__table__, SalesHistory.__table__, Forecast.__table__):
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+def _rebuild_sqlite_table(conn, table):
+    """
+    SQLite не умеет менять DEFAULT колонки: создаём таблицу заново по models.py,
+    переносим строки и пересоздаём индексы.
+    """
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    columns = ", ".join(c.name for c in table.columns if c.name in existing)
+    # Копия схемы нужна, чтобы внешние ключи новой таблицы нашли связанные таблицы
+    metadata = MetaData()
+    for other in Base.metadata.sorted_tables:
+        other.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f"{table.name}__new")
+
+    conn.execute(CreateTable(new_table))
+    conn.execute(text(f"INSERT INTO {new_table.name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_table.name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(bind=conn)
+
+
+def ensure_created_at_defaults():
+    """
+    Досоздаёт DEFAULT now() для created_at в уже существующих таблицах
+    (create_all не меняет существующие колонки): время вставки проставляет БД.
+    PostgreSQL — ALTER COLUMN, SQLite — пересоздание таблицы.
+    Затрагиваются только колонки без DEFAULT.
+    """
+    inspector = inspect(engine)
+    missing = [
+        table
+        for table in (User.__table__, Product.__table__, SalesHistory.__table__, Forecast.__table__)
+        if any(
+            c["name"] == "created_at" and c["default"] is None
+            for c in inspector.get_columns(table.name)
+        )
+    ]
+    if not missing:
+        return
+
+    with engine.begin() as conn:
+        for table in missing:
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN created_at SET DEFAULT now()"))
+            else:
+                _rebuild_sqlite_table(conn, table)
+    print(f"✅ DEFAULT now() для created_at добавлен: {', '.join(t.name for t in missing)}")
+
+
+def ensure_unlogged_forecasts():
+    """
+    PostgreSQL: переводит таблицу прогнозов в UNLOGGED (без записи в WAL).
+    Прогнозы пересчитываются при каждом запуске Prophet, поэтому их потеря
+    после сбоя сервера БД допустима. ALTER переписывает таблицу под эксклюзивной
+    блокировкой — выполняется только здесь и только пока таблица ещё обычная.
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+
+    with engine.begin() as conn:
+        persistence = conn.execute(
+            text("SELECT relpersistence FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": Forecast.__tablename__}
+        ).scalar()
+        if persistence == 'p':
+            conn.execute(text(f"ALTER TABLE {Forecast.__tablename__} SET UNLOGGED"))
+            print(f"✅ Таблица {Forecast.__tablename__} переведена в UNLOGGED")
+
+
+def migrate():
+    """
+    Все шаги по порядку. Ошибка любого шага не глушится: процесс завершается
+    с ошибкой, и uvicorn не стартует на недоделанной схеме.
+    """
+    Base.metadata.create_all(bind=engine)
+    dedupe_sales_history()
+    ensure_indexes()
+    ensure_created_at_defaults()
+    ensure_unlogged_forecasts()
+
+
+if __name__ == "__main__":
+    migrate()
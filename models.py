@@ -1,6 +1,6 @@
 # models.py
 
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, JSON, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -16,16 +16,19 @@ class User(Base):
     email = Column(String, unique=True, nullable=False, index=True)  # ← ДОБАВЛЕНО
     password_hash = Column(String, nullable=False)  # ← Переименовано для согласованности
     store_name = Column(String, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())  # Время вставки проставляет БД
 
-    # Связи
-    products = relationship("Product", back_populates="user", cascade="all, delete-orphan")
-    sales_history = relationship("SalesHistory", back_populates="user", cascade="all, delete-orphan")
+    # Связи (коллекции не подгружаются лениво: нужна явная загрузка через selectinload)
+    products = relationship("Product", back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    sales_history = relationship("SalesHistory", back_populates="user", cascade="all, delete-orphan", lazy="raise")
 
 
 class Product(Base):
     """Товары в системе."""
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_product_user_sku", "user_id", "sku"),  # Поиск товара по артикулу при загрузке
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -33,25 +36,31 @@ class Product(Base):
     name = Column(String, nullable=False)  # Название товара
     current_stock = Column(Float, default=0.0)  # Текущий остаток
     unit_price = Column(Float, default=0.0)  # Цена за единицу
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
 
-    # Связи
+    # Связи (коллекции не подгружаются лениво: нужна явная загрузка через selectinload)
     user = relationship("User", back_populates="products")
-    sales_history = relationship("SalesHistory", back_populates="product", cascade="all, delete-orphan")
-    forecasts = relationship("Forecast", back_populates="product", cascade="all, delete-orphan")
+    sales_history = relationship("SalesHistory", back_populates="product", cascade="all, delete-orphan", lazy="raise")
+    forecasts = relationship("Forecast", back_populates="product", cascade="all, delete-orphan", lazy="raise")
 
 
 class SalesHistory(Base):
     """История продаж."""
     __tablename__ = "sales_history"
+    __table_args__ = (
+        # Одна запись на товар в день — ключ для UPSERT при повторной загрузке
+        Index("uq_sales_uid_pid_date", "user_id", "product_id", "date", unique=True),
+        Index("ix_sales_uid_date", "user_id", "date"),  # Дашборд: продажи пользователя за период
+        Index("ix_sales_product_date", "product_id", "date"),  # История товара по датам (карточка, Prophet)
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
-    date = Column(Date, nullable=False, index=True)  # Дата продажи
+    date = Column(Date, nullable=False)  # Дата продажи
     quantity_sold = Column(Float, nullable=False)  # Кол-во проданного
     sale_price = Column(Float, nullable=False)  # Цена продажи
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
 
     # Связи
     user = relationship("User", back_populates="sales_history")
@@ -61,12 +70,24 @@ class SalesHistory(Base):
 class Forecast(Base):
     """Прогнозы продаж (результаты Prophet)."""
     __tablename__ = "forecasts"
+    __table_args__ = (
+        Index("ix_forecast_pid_date", "product_id", "forecast_date"),  # Прогноз товара по датам
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     forecast_date = Column(Date, nullable=False, index=True)  # Дата прогноза
     predicted_quantity = Column(Float, nullable=False)  # Прогнозируемое кол-во продаж
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
 
     # Связи
     product = relationship("Product", back_populates="forecasts")
+
+
+class DashboardCache(Base):
+    """Предрассчитанные агрегаты дашборда (обновляются при загрузке продаж)."""
+    __tablename__ = "dashboard_cache"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    payload = Column(JSON, nullable=False)  # Продажи по дням, средние по товарам, число записей
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
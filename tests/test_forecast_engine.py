@@ -0,0 +1,126 @@
+# tests/test_forecast_engine.py
+# Запуск из корня проекта: python -m unittest discover tests
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+try:
+    import forecast_engine
+except ImportError as e:  # prophet и прочие зависимости из requirements.txt
+    raise unittest.SkipTest(f"forecast_engine недоступен: {e}")
+
+
+def _write_csv(text: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+class ReadSalesCsvDatesTest(unittest.TestCase):
+    """Даты распознаются при чтении CSV, _parse_dates их не разбирает повторно"""
+
+    def _read_dates(self, rows: str) -> pd.Series:
+        path = _write_csv("Дата,Артикул\n" + rows)
+        try:
+            return forecast_engine._read_sales_csv(path)["Дата"]
+        finally:
+            os.remove(path)
+
+    def test_iso_dates_are_datetime64(self):
+        dates = self._read_dates("2025-01-02,S1\n2025-01-03,S1\n")
+
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(dates))
+        # Быстрый путь: колонка возвращается как есть, без разбора строк
+        self.assertIs(forecast_engine._parse_dates(dates), dates)
+        self.assertEqual(
+            dates.dt.date.astype(str).tolist(), ["2025-01-02", "2025-01-03"]
+        )
+
+    def test_dayfirst_dates_are_datetime64(self):
+        dates = self._read_dates("02.01.2025,S1\n03.01.2025,S1\n")
+
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(dates))
+        self.assertIs(forecast_engine._parse_dates(dates), dates)
+        self.assertEqual(
+            dates.dt.date.astype(str).tolist(), ["2025-01-02", "2025-01-03"]
+        )
+
+
+class SeasonalNaiveForecastTest(unittest.TestCase):
+    """Недельный профиль строится по календарным дням, а не по строкам истории"""
+
+    def test_gappy_history_keeps_weekday_phase(self):
+        # Продажи только по понедельникам: остальных дней в истории нет
+        mondays = pd.date_range("2025-01-06", periods=30, freq="W-MON")
+        history = pd.DataFrame({"ds": mondays, "y": 7.0})
+
+        product_id, dates, yhat = forecast_engine._seasonal_naive_forecast(1, history)
+
+        self.assertEqual(product_id, 1)
+        self.assertEqual(len(dates), 30)
+        self.assertEqual(dates[0], (mondays[-1] + pd.Timedelta(days=1)).date())
+        for day, value in zip(dates, yhat):
+            expected = 7.0 if day.weekday() == 0 else 0.0
+            self.assertAlmostEqual(value, expected, msg=str(day))
+
+    def test_full_history_uses_last_four_weeks(self):
+        days = pd.date_range("2025-01-01", periods=60)
+        history = pd.DataFrame({"ds": days, "y": [float(d.weekday()) for d in days]})
+
+        _, dates, yhat = forecast_engine._seasonal_naive_forecast(1, history)
+
+        for day, value in zip(dates, yhat):
+            self.assertAlmostEqual(value, float(day.weekday()), msg=str(day))
+
+
+
+class FitAndPredictTest(unittest.TestCase):
+    """Сбой оптимизатора не должен оставлять пакет товаров без прогнозов"""
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(forecast_engine, "PROPHET_CACHE_DIR", cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        days = pd.date_range("2025-01-01", periods=forecast_engine.MIN_PROPHET_HISTORY_DAYS)
+        self.history = pd.DataFrame({"ds": days, "y": [float(d.weekday() + 1) for d in days]})
+
+    def test_newton_failure_retries_with_lbfgs(self):
+        original_fit = forecast_engine._SharedFeaturesProphet.fit
+        algorithms = []
+
+        def fit(model, df, **kwargs):
+            algorithms.append(kwargs.get("algorithm"))
+            if kwargs.get("algorithm") == "Newton":
+                raise RuntimeError("Newton optimization failed")
+            return original_fit(model, df, **kwargs)
+
+        with mock.patch.object(forecast_engine._SharedFeaturesProphet, "fit", fit):
+            product_id, dates, yhat = forecast_engine._fit_and_predict(1, self.history)
+
+        self.assertEqual(algorithms, ["Newton", "LBFGS"])
+        self.assertEqual(product_id, 1)
+        self.assertEqual(len(dates), 30)
+        self.assertEqual(len(yhat), 30)
+
+    def test_failure_is_returned_per_product(self):
+        def fit(model, df, **kwargs):
+            raise RuntimeError("optimization failed")
+
+        with mock.patch.object(forecast_engine._SharedFeaturesProphet, "fit", fit):
+            product_id, dates, error = forecast_engine._fit_and_predict_safe(2, self.history)
+
+        self.assertEqual(product_id, 2)
+        self.assertIsNone(dates)
+        self.assertIn("optimization failed", error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,90 @@
 # utils.py (ФИНАЛЬНАЯ ВЕРСИЯ)
 
-from passlib.context import CryptContext
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
 
-# Настройка хеширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+import bcrypt
+import jwt
+from starlette.concurrency import run_in_threadpool
+
+# Хеширование паролей — напрямую через bcrypt (формат $2b$ совместим
+# с хешами, созданными ранее через passlib)
+BCRYPT_IDENT = "$2b$"
+BCRYPT_ROUNDS = 12
+
+# Подпись токенов доступа. Ключ должен быть общим для всех воркеров и переживать
+# перезапуск — иначе ранее выданные токены станут недействительны.
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    SECRET_KEY = secrets.token_urlsafe(32)
+    print("⚠️ SECRET_KEY не задан: используется временный ключ, токены не переживут перезапуск")
+
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60 * 24))
 
 
 def get_password_hash(password: str) -> str:
     """Хеширует пароль с использованием bcrypt"""
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    ).decode("ascii")
+
+
+async def ahash_password(password: str) -> str:
+    """Хеширует пароль в пуле потоков — bcrypt не блокирует event loop async-эндпоинтов"""
+    return await run_in_threadpool(get_password_hash, password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверяет соответствие пароля хешу"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Проверяет соответствие пароля хешу (битый хеш — просто неверный пароль)"""
+    try:
+        return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("ascii"))
+    except ValueError:
+        return False
+
+
+def _password_hash_outdated(hashed_password: str) -> bool:
+    """Хеш другого варианта bcrypt ($2a$, $2y$) или с меньшим cost — пора перехешировать"""
+    if not hashed_password.startswith(BCRYPT_IDENT):
+        return True
+    try:
+        return int(hashed_password[4:6]) < BCRYPT_ROUNDS
+    except ValueError:
+        return True
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Проверяет пароль и, если хеш устарел (вариант или cost), возвращает новый хеш.
+    Возвращает (пароль верен, новый хеш или None)
+    """
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if _password_hash_outdated(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
+
+
+# Хеш случайного пароля: проверяется при входе несуществующего пользователя,
+# чтобы время ответа не выдавало, есть ли такой логин
+DUMMY_HASH = get_password_hash(secrets.token_hex(16))
+
+
+def create_access_token(user_id: int) -> str:
+    """Выдаёт подписанный JWT с id пользователя и сроком действия"""
+    payload = {
+        "sub": str(user_id),
+        "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def decode_access_token(token: str) -> Optional[int]:
+    """Проверяет подпись и срок токена; возвращает id пользователя или None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        return int(payload["sub"])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        return None